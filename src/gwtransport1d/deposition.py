@@ -22,17 +22,33 @@ and time series handling. It is designed for researchers and engineers working o
 groundwater contamination and transport problems.
 """
 
+import hashlib
+import threading
+
 import numpy as np
 import pandas as pd
-from scipy.linalg import null_space
 from scipy.optimize import minimize
+from scipy.sparse import csr_array
 
 from gwtransport1d.residence_time import residence_time_retarded
-from gwtransport1d.utils import interp_series
+from gwtransport1d.utils import interp_series, lstsq_null_space
+
+# Results of deposition_coefficients for the most recent inputs, e.g., reused by compute_dc after compute_deposition
+DEPOSITION_COEFFICIENTS_CACHE_SIZE = 8
+_deposition_coefficients_cache = {}
+_deposition_coefficients_cache_lock = threading.Lock()
 
 
 def compute_deposition(
-    cout, flow, aquifer_pore_volume, porosity, thickness, retardation_factor, nullspace_objective="squared_lengths"
+    cout,
+    flow,
+    aquifer_pore_volume,
+    porosity,
+    thickness,
+    retardation_factor,
+    nullspace_objective="squared_lengths",
+    *,
+    warm_start=True,
 ):
     """
     Compute the deposition given the added concentration of the compound in the extracted water.
@@ -53,6 +69,10 @@ def compute_deposition(
         Retardation factor of the compound in the aquifer [dimensionless].
     nullspace_objective : str or callable, optional
         Objective to minimize in the nullspace. If a string, it should be either "squared_lengths" or "summed_lengths". If a callable, it should take the form `objective(x, xLS, colsOfNullspace)`. Default is "squared_lengths".
+    warm_start : bool, optional
+        Start the minimization of the "summed_lengths" or callable objective from the closed-form solution of the
+        "squared_lengths" objective. If False, it starts from the minimum norm least squares solution. Default is
+        True.
 
     Returns
     -------
@@ -74,51 +94,61 @@ def compute_deposition(
         msg = f"Length of cout ({len(cout)}) should be equal to the number of rows in coeff ({coeff.shape[0]})"
         raise ValueError(msg)
 
-    if not index_dep.isin(flow.index).all():
-        msg = "The flow timeseries is either not long enough or is not alligned well"
-        raise ValueError(msg, index_dep, flow.index)
-
-    # Underdetermined least squares solution
-    deposition_ls, *_ = np.linalg.lstsq(coeff, cout, rcond=None)
-
-    # Nullspace -> multiple solutions exist, deposition_ls is just one of them
-    cols_of_nullspace = null_space(coeff, rcond=None)
-    nullrank = cols_of_nullspace.shape[1]
+    # Underdetermined least squares solution and the nullspace -> multiple solutions exist, deposition_ls is
+    # just one of them
+    deposition_ls, cols_of_nullspace = lstsq_null_space(coeff, cout.values)
 
-    # Pick a solution in the nullspace that meets new objective
-    def objective(x, x_ls, cols_of_nullspace):
-        sols = x_ls + cols_of_nullspace @ x
-        return np.square(sols[1:] - sols[:-1]).sum()
+    # Pick a solution in the nullspace that meets new objective. Minimizing the squared lengths, the squared
+    # differences between consecutive days, is a linear least squares problem with a closed-form solution
+    diff_nullspace = np.diff(cols_of_nullspace, axis=0)
+    diff_ls = np.diff(deposition_ls)
 
-    deposition_0 = np.zeros(nullrank)
-    res = minimize(objective, x0=deposition_0, args=(deposition_ls, cols_of_nullspace), method="BFGS")
+    # Squared lengths is stable to solve, thus a good starting point
+    if nullspace_objective == "squared_lengths" or warm_start:
+        x0, *_ = np.linalg.lstsq(diff_nullspace, -diff_ls, rcond=None)
+    else:
+        x0 = np.zeros(cols_of_nullspace.shape[1])
 
-    if not res.success:
-        msg = f"Optimization failed: {res.message}"
-        raise ValueError(msg)
+    if nullspace_objective == "squared_lengths":
+        x = x0
 
-    # Squared lengths is stable to solve, thus a good starting point
-    if nullspace_objective != "squared_lengths":
+    else:
         if nullspace_objective == "summed_lengths":
 
-            def objective(x, x_ls, cols_of_nullspace):
-                sols = x_ls + cols_of_nullspace @ x
-                return np.abs(sols[1:] - sols[:-1]).sum()
+            def objective(x, diff_nullspace, diff_ls):
+                return np.abs(diff_nullspace @ x + diff_ls).sum()
 
-            res = minimize(objective, x0=res.x, args=(deposition_ls, cols_of_nullspace), method="BFGS")
+            def jac(x, diff_nullspace, diff_ls):
+                return diff_nullspace.T @ np.sign(diff_nullspace @ x + diff_ls)
+
+            args = (diff_nullspace, diff_ls)
 
         elif callable(nullspace_objective):
-            res = minimize(nullspace_objective, x0=res.x, args=(deposition_ls, cols_of_nullspace), method="BFGS")
+            objective = nullspace_objective
+            jac = None
+            args = (deposition_ls, cols_of_nullspace)
 
         else:
             msg = f"Unknown nullspace objective: {nullspace_objective}"
             raise ValueError(msg)
 
+        # Limited memory BFGS, as the dense inverse Hessian of BFGS is costly for large nullspaces
+        res = minimize(
+            objective,
+            x0=x0,
+            args=args,
+            method="L-BFGS-B",
+            jac=jac,
+            options={"ftol": 1e-9, "gtol": 1e-7, "maxcor": 50},
+        )
+
         if not res.success:
             msg = f"Optimization failed: {res.message}"
             raise ValueError(msg)
 
-    deposition_data = deposition_ls + cols_of_nullspace @ res.x
+        x = res.x
+
+    deposition_data = deposition_ls + cols_of_nullspace @ x
     return pd.Series(data=deposition_data, index=index_dep, name="deposition")
 
 
@@ -155,7 +185,7 @@ def compute_dc(dcout_index, deposition, flow, aquifer_pore_volume, porosity, thi
         thickness=thickness,
         retardation_factor=retardation_factor,
     )
-    return pd.Series(coeff @ deposition[dep_index], index=dcout_index, name="dcout")
+    return pd.Series(coeff @ deposition[dep_index].values, index=dcout_index, name="dcout")
 
 
 def deposition_coefficients(dcout_index, flow, aquifer_pore_volume, porosity, thickness, retardation_factor):
@@ -179,62 +209,157 @@ def deposition_coefficients(dcout_index, flow, aquifer_pore_volume, porosity, th
 
     Returns
     -------
-    numpy.ndarray
+    scipy.sparse.csr_array
         Coefficients of the deposition model [m2/day].
     pandas.DataFrame
         Dataframe containing the residence time of the retarded compound in the aquifer [days].
     pandas.DatetimeIndex
         Datetime index of the deposition.
+
+    Notes
+    -----
+    The results of the last `DEPOSITION_COEFFICIENTS_CACHE_SIZE` calls are cached and the same objects are
+    returned for identical inputs. Do not modify the returned objects in place.
     """
+    if retardation_factor * porosity * thickness == 0.0:
+        msg = "retardation_factor, porosity, and thickness should be nonzero"
+        raise ValueError(msg)
+
+    key = (
+        hash_datetime_index_and_values(dcout_index),
+        hash_datetime_index_and_values(flow.index, flow.values),
+        float(aquifer_pore_volume),
+        float(porosity),
+        float(thickness),
+        float(retardation_factor),
+    )
+    with _deposition_coefficients_cache_lock:
+        if key in _deposition_coefficients_cache:
+            return _deposition_coefficients_cache[key]
+
     # Get deposition indices
     rt = residence_time_retarded(
-        flow, aquifer_pore_volume, retardation_factor=retardation_factor, direction="extraction"
+        flow, aquifer_pore_volume, retardation_factor=retardation_factor, direction="extraction", return_as_series=True
     )
-    index_dep = deposition_index_from_dcout_index(dcout_index, flow, aquifer_pore_volume, retardation_factor)
+    index_dep = deposition_index_from_dcout_index(dcout_index, flow, aquifer_pore_volume, retardation_factor, rt=rt)
 
     if not index_dep.isin(flow.index).all():
         msg = "The flow timeseries is either not long enough or is not alligned well"
         raise ValueError(msg, index_dep, flow.index)
 
+    # Work with datetime64[ns] and timedelta64[ns] arrays to avoid creating Timedelta objects
+    day = np.timedelta64(1, "D").astype("timedelta64[ns]")
+    dates_extraction = dcout_index.values.astype("datetime64[ns]")
+    dates_dep = index_dep.values.astype("datetime64[ns]")
+    index_infiltration, rt_days = dates_infiltration_from_dcout_index(dcout_index, rt)
+    dates_infiltration = index_infiltration.values.astype("datetime64[ns]")
+    rt_timedelta = dates_extraction - dates_infiltration
+
     df = pd.DataFrame(
         data={
-            "flow": flow[dcout_index.floor(freq="D")].values,
-            "rt": pd.to_timedelta(interp_series(rt, dcout_index), "D"),
-            "dates_infiltration_retarded": dcout_index - pd.to_timedelta(interp_series(rt, dcout_index), "D"),
-            "darea": flow[dcout_index.floor(freq="D")].values
-            / (retardation_factor * porosity * thickness),  # Aquifer area cathing deposition
+            "rt": rt_timedelta,
+            "dates_infiltration_retarded": index_infiltration,
         },
         index=dcout_index,
     )
 
-    # Compute coefficients
-    dt = np.zeros((len(dcout_index), len(index_dep)), dtype=float)
+    # Compute coefficients. Each row is a contiguous band of days, thus stored as a sparse matrix
+    itinf = np.searchsorted(dates_dep.view("i8"), dates_infiltration.view("i8"), side="right") - 1  # partial day
+
+    if itinf.min() < 0:
+        msg = "Infiltration dates precede the deposition index"
+        raise ValueError(msg)
+
+    # index_dep is a daily range, thus the extraction day follows from the whole days since its start
+    itextr = (dates_extraction - dates_dep[0]) // day  # partial day
+    frac_inf = (dates_dep[itinf + 1] - dates_infiltration) / day
+    frac_extr = (dates_extraction - dates_dep[itextr]) / day
 
-    for iout, (date_extraction, row) in enumerate(df.iterrows()):
-        itinf = index_dep.searchsorted(row.dates_infiltration_retarded.floor(freq="D"))  # partial day
-        itextr = index_dep.searchsorted(date_extraction.floor(freq="D"))  # whole day
+    # Write the rows of the sparse matrix in a single pass, without assembling them one by one
+    nnz_row = itextr - itinf + 1
+    indptr = np.concatenate(([0], np.cumsum(nnz_row)))
 
-        dt[iout, itinf] = (index_dep[itinf + 1] - row.dates_infiltration_retarded) / pd.to_timedelta(1.0, unit="D")
-        dt[iout, itinf + 1 : itextr] = 1.0
+    # Column indices increase by one within a row and jump back to the infiltration day at the start of the next
+    # row. Their cumulative sum avoids the temporary arrays of np.arange and np.repeat
+    indices = np.ones(indptr[-1], dtype=np.intp)
+    indices[0] = itinf[0]
+    indices[indptr[1:-1]] = itinf[1:] - itextr[:-1]
+    np.cumsum(indices, out=indices)
 
-        # fraction of first day
-        dt[iout, itextr] = (date_extraction - index_dep[itextr]) / pd.to_timedelta(1.0, unit="D")
+    # Coefficients are kept in float64; the inversion in compute_deposition amplifies float32 round-off errors
+    dt = np.ones(indptr[-1], dtype=np.float64)  # whole days in between infiltration and extraction
+    dt[indptr[:-1]] = frac_inf  # fraction of first day
+    dt[indptr[1:] - 1] = frac_extr  # fraction of last day
 
-    if not np.isclose(dt.sum(axis=1), df.rt.values / pd.to_timedelta(1.0, unit="D")).all():
+    if not np.isclose(np.add.reduceat(dt, indptr[:-1]), rt_days).all():
         msg = "Residence times do not match"
         raise ValueError(msg)
 
-    flow_floor = flow.median() / 100.0  # m3/day To increase numerical stability
-    flow_floored = df.flow.clip(lower=flow_floor)
-    coeff = (df.darea / flow_floored).values[:, None] * dt
+    # Aquifer area catching deposition per unit of extracted water, darea / flow, is independent of the flow
+    dt /= retardation_factor * porosity * thickness
+    coeff = csr_array((dt, indices, indptr), shape=(len(dcout_index), len(index_dep)))
 
-    if np.isnan(coeff).any():
+    if np.isnan(coeff.data).any():
         msg = "Coefficients contain nan values."
         raise ValueError(msg)
 
+    # Dictionaries preserve insertion order, thus the first key is the oldest
+    with _deposition_coefficients_cache_lock:
+        if len(_deposition_coefficients_cache) >= DEPOSITION_COEFFICIENTS_CACHE_SIZE:
+            del _deposition_coefficients_cache[next(iter(_deposition_coefficients_cache))]
+
+        _deposition_coefficients_cache[key] = coeff, df, index_dep
     return coeff, df, index_dep
 
 
+def hash_datetime_index_and_values(index, values=None):
+    """
+    Compute a digest of a datetime index, its timezone, and optionally the values of a series to use as cache key.
+
+    Parameters
+    ----------
+    index : pandas.DatetimeIndex
+        Datetime index.
+    values : numpy.ndarray, optional
+        Values belonging to the index. Default is None.
+
+    Returns
+    -------
+    bytes
+        Digest of the index and values.
+    """
+    # The values are in UTC, thus the timezone distinguishes indices with the same instants
+    h = hashlib.blake2b(index.values.astype("datetime64[ns]").tobytes())
+    h.update(str(index.tz).encode())
+    if values is not None:
+        h.update(np.ascontiguousarray(values, dtype=float).tobytes())
+    return h.digest()
+
+
+def dates_infiltration_from_dcout_index(dcout_index, rt):
+    """
+    Compute the infiltration dates of the retarded compound that is extracted at the dcout index.
+
+    Parameters
+    ----------
+    dcout_index : pandas.DatetimeIndex
+        Index of the concentration of the compound in the extracted water.
+    rt : pandas.Series
+        Residence time of the retarded compound at the index of `flow` [days], as returned by
+        `residence_time_retarded` with `return_as_series=True`.
+
+    Returns
+    -------
+    pandas.DatetimeIndex
+        Infiltration dates of the retarded compound, in the timezone of `dcout_index`.
+    numpy.ndarray
+        Residence time of the retarded compound at `dcout_index` [days].
+    """
+    rt_days = interp_series(rt, dcout_index)
+    rt_timedelta = rt_days * np.timedelta64(1, "D").astype("timedelta64[ns]")
+    return dcout_index - pd.to_timedelta(rt_timedelta), rt_days
+
+
 def dcout_date_range_from_dcout_index(dcout_index):
     """
     Compute the date range of the concentration of the compound in the extracted water.
@@ -252,7 +377,7 @@ def dcout_date_range_from_dcout_index(dcout_index):
     return pd.date_range(start=dcout_index.min().floor("D"), end=dcout_index.max(), freq="D")
 
 
-def deposition_index_from_dcout_index(dcout_index, flow, aquifer_pore_volume, retardation_factor):
+def deposition_index_from_dcout_index(dcout_index, flow, aquifer_pore_volume, retardation_factor, *, rt=None):
     """
     Compute the index of the deposition from the concentration of the compound in the extracted water index.
 
@@ -270,16 +395,26 @@ def deposition_index_from_dcout_index(dcout_index, flow, aquifer_pore_volume, re
         Pore volume of the aquifer [m3].
     retardation_factor : float
         Retardation factor of the compound in the aquifer [dimensionless].
+    rt : pandas.Series, optional
+        Residence time of the retarded compound at the index of `flow` [days], as returned by
+        `residence_time_retarded` with `return_as_series=True`. If left to None, it is computed. Default is None.
 
     Returns
     -------
     pandas.DatetimeIndex
         Index of the deposition.
     """
-    rt = residence_time_retarded(
-        flow, aquifer_pore_volume, retardation_factor=retardation_factor, direction="extraction"
-    )
-    rt_at_start_cout = pd.to_timedelta(interp_series(rt, dcout_index.min()), "D")
-    start_dep = (dcout_index.min() - rt_at_start_cout).floor("D")
+    if rt is None:
+        rt = residence_time_retarded(
+            flow,
+            aquifer_pore_volume,
+            retardation_factor=retardation_factor,
+            direction="extraction",
+            return_as_series=True,
+        )
+
+    # Same arithmetic as deposition_coefficients, so that the first infiltration date is never before start_dep
+    index_infiltration, _ = dates_infiltration_from_dcout_index(dcout_index[[dcout_index.argmin()]], rt)
+    start_dep = index_infiltration[0].floor("D")
     end_dep = dcout_index.max()
     return pd.date_range(start=start_dep, end=end_dep, freq="D")
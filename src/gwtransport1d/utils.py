@@ -3,6 +3,13 @@
 import numpy as np
 import pandas as pd
 from scipy import interpolate
+from scipy.linalg import qr, svd
+from scipy.sparse import issparse
+from scipy.sparse.linalg import norm as sparse_norm
+from scipy.sparse.linalg import splu
+
+# Maximum number of elements of a sparse matrix for which lstsq_null_space uses a dense SVD
+LSTSQ_NULL_SPACE_SVD_MAX_SIZE = 100_000
 
 
 def linear_interpolate(x_ref, y_ref, x_query, left=None, right=None):
@@ -86,3 +93,109 @@ def interp_series(series, index_new, **interp1d_kwargs):
     dt_interp = (index_new - series.index[0]) / pd.to_timedelta(1, unit="D")
     interp_obj = interpolate.interp1d(dt, series.values, bounds_error=False, **interp1d_kwargs)
     return interp_obj(dt_interp)
+
+
+def lstsq_null_space(a, b, rcond=None):
+    """
+    Compute the minimum norm least squares solution and the nullspace of a matrix.
+
+    Dense matrices and small sparse matrices are decomposed with a single SVD. Sparse matrices with more than
+    `LSTSQ_NULL_SPACE_SVD_MAX_SIZE` elements and full row rank are solved with `lstsq_null_space_sparse`.
+
+    Parameters
+    ----------
+    a : numpy.ndarray or scipy.sparse.sparray
+        Matrix of shape (M, N).
+    b : numpy.ndarray
+        Right hand side of shape (M,).
+    rcond : float, optional
+        Relative condition number. Singular values smaller than `rcond * max(s)` are considered zero.
+        If left to None, `eps * max(M, N)` is used, as in `scipy.linalg.null_space`. Ignored if `a` is solved
+        with `lstsq_null_space_sparse`, which instead falls back to the SVD if its residuals exceed
+        `eps * max(M, N)`. Default is None.
+
+    Returns
+    -------
+    numpy.ndarray
+        Minimum norm least squares solution of shape (N,).
+    numpy.ndarray
+        Orthonormal basis of the nullspace of `a` of shape (N, K), with K the nullity of `a`.
+    """
+    if issparse(a):
+        if a.shape[0] * a.shape[1] > LSTSQ_NULL_SPACE_SVD_MAX_SIZE and a.shape[0] <= a.shape[1]:
+            try:
+                return lstsq_null_space_sparse(a, b)
+            except ValueError:
+                pass  # Rows are (nearly) linearly dependent, fall back to SVD
+
+        a = a.toarray()
+
+    u, s, vh = svd(a, full_matrices=True, check_finite=False)
+
+    if rcond is None:
+        rcond = np.finfo(s.dtype).eps * max(a.shape)
+
+    rank = np.sum(s > s.max(initial=0.0) * rcond)
+    x = vh[:rank].T @ ((u[:, :rank].T @ b) / s[:rank])
+    return x, vh[rank:].conj().T
+
+
+def lstsq_null_space_sparse(a, b, seed=0):
+    """
+    Compute the minimum norm least squares solution and the nullspace of a sparse matrix with full row rank.
+
+    Instead of an SVD, the sparse matrix `a @ a.T` is factorized once and used to project onto the row space
+    of `a`. The least squares solution is `a.T @ inv(a @ a.T) @ b` and the nullspace is spanned by random
+    vectors from which their projection onto the row space is removed. The projection is applied twice to
+    reduce round-off errors, after which the vectors are orthonormalized. Only efficient if the number of
+    columns is slightly larger than the number of rows, as is the case for banded matrices.
+
+    Factorizing `a @ a.T` squares the condition number of `a`. Therefore, the relative residuals of the
+    solution and of the nullspace are checked against `eps * max(M, N)`.
+
+    Parameters
+    ----------
+    a : scipy.sparse.sparray
+        Sparse matrix of shape (M, N) with full row rank, M <= N.
+    b : numpy.ndarray
+        Right hand side of shape (M,).
+    seed : int, optional
+        Seed of the random vectors that are projected onto the nullspace. Default is 0.
+
+    Returns
+    -------
+    numpy.ndarray
+        Minimum norm least squares solution of shape (N,).
+    numpy.ndarray
+        Orthonormal basis of the nullspace of `a` of shape (N, N - M).
+
+    Raises
+    ------
+    ValueError
+        If `a` does not have full row rank, or if its rows are nearly linearly dependent such that the residuals
+        exceed the tolerance.
+    """
+    try:
+        lu = splu((a @ a.T).tocsc())
+    except RuntimeError as e:
+        msg = "Matrix does not have full row rank"
+        raise ValueError(msg) from e
+
+    def project_null_space(v):
+        return v - a.T @ lu.solve(a @ v)
+
+    x = a.T @ lu.solve(b)
+
+    nullity = a.shape[1] - a.shape[0]
+    v = np.random.default_rng(seed).standard_normal((a.shape[1], nullity))
+    q, _ = qr(project_null_space(project_null_space(v)), mode="economic")
+
+    norm_a = sparse_norm(a)
+    tol = np.finfo(np.float64).eps * max(a.shape)
+    if np.linalg.norm(a @ x - b) > tol * (norm_a * np.linalg.norm(x) + np.linalg.norm(b)) or np.any(
+        np.linalg.norm(a @ q, axis=0) > tol * norm_a
+    ):
+        msg = "Matrix rows are nearly linearly dependent, residuals exceed the tolerance"
+        raise ValueError(msg)
+
+    return x, q
@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gwtransport1d.deposition import compute_dc, compute_deposition, deposition_coefficients
+from gwtransport1d.residence_time import residence_time_retarded
+from gwtransport1d.utils import interp_series
+
+
+@pytest.fixture
+def aquifer():
+    """Aquifer properties with a residence time of roughly a month."""
+    dates = pd.date_range("2020-01-01", periods=400, freq="D")
+    flow = pd.Series(7200.0, index=dates, name="flow")
+    flow.iloc[100:200] = 12120.0
+    flow.iloc[200:300] = 1992.0
+    return {
+        "flow": flow,
+        "aquifer_pore_volume": flow.mean() * 35.3,
+        "porosity": 0.3,
+        "thickness": 15.0,
+        "retardation_factor": 2.1,
+    }
+
+
+@pytest.fixture
+def dcout_index():
+    return pd.date_range("2020-06-01", "2020-12-31", freq="D")
+
+
+def test_deposition_coefficients_row_sums(aquifer, dcout_index):
+    """Each row integrates the deposition over the retarded residence time."""
+    coeff, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+
+    assert coeff.shape == (len(dcout_index), len(index_dep))
+    assert np.all(coeff.data >= 0.0)
+
+    rt = residence_time_retarded(
+        aquifer["flow"],
+        aquifer["aquifer_pore_volume"],
+        retardation_factor=aquifer["retardation_factor"],
+        return_as_series=True,
+    )
+    scale = aquifer["retardation_factor"] * aquifer["porosity"] * aquifer["thickness"]
+    assert np.allclose(coeff.sum(axis=1) * scale, interp_series(rt, dcout_index))
+
+
+def test_compute_dc_constant_deposition(aquifer, dcout_index):
+    """A constant deposition increases the concentration proportional to the residence time."""
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    deposition = pd.Series(2.0, index=index_dep)
+
+    dcout = compute_dc(dcout_index, deposition, **aquifer)
+
+    rt = residence_time_retarded(
+        aquifer["flow"],
+        aquifer["aquifer_pore_volume"],
+        retardation_factor=aquifer["retardation_factor"],
+        return_as_series=True,
+    )
+    scale = aquifer["retardation_factor"] * aquifer["porosity"] * aquifer["thickness"]
+    assert np.allclose(dcout, 2.0 * interp_series(rt, dcout_index) / scale)
+
+
+def test_compute_deposition_constant(aquifer, dcout_index):
+    """The smoothest deposition that explains the concentrations of a constant deposition is that constant."""
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    deposition = pd.Series(1.0, index=index_dep)
+    dcout = compute_dc(dcout_index, deposition, **aquifer)
+
+    result = compute_deposition(dcout, **aquifer)
+
+    assert result.index.equals(index_dep)
+    assert np.allclose(result, 1.0, atol=1e-6)
+
+
+def test_compute_deposition_reproduces_dcout(aquifer, dcout_index):
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    deposition = pd.Series(1.0 + 0.5 * np.sin(np.arange(len(index_dep)) / 10.0), index=index_dep)
+    dcout = compute_dc(dcout_index, deposition, **aquifer)
+
+    result = compute_deposition(dcout, **aquifer)
+
+    assert np.allclose(compute_dc(dcout_index, result, **aquifer), dcout, rtol=1e-6)
+
+
+def test_compute_deposition_unknown_objective(aquifer, dcout_index):
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    dcout = compute_dc(dcout_index, pd.Series(1.0, index=index_dep), **aquifer)
+
+    with pytest.raises(ValueError, match="Unknown nullspace objective"):
+        compute_deposition(dcout, **aquifer, nullspace_objective="unknown")
+
+
+@pytest.mark.parametrize("warm_start", [True, False])
+def test_compute_deposition_callable_objective(aquifer, dcout_index, warm_start):
+    """The closed-form squared lengths solution is the minimum of the equivalent callable objective."""
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    deposition = pd.Series(1.0 + 0.5 * np.sin(np.arange(len(index_dep)) / 10.0), index=index_dep)
+    dcout = compute_dc(dcout_index, deposition, **aquifer)
+
+    def squared_lengths(x, x_ls, cols_of_nullspace):
+        sols = x_ls + cols_of_nullspace @ x
+        return np.square(sols[1:] - sols[:-1]).sum()
+
+    expected = compute_deposition(dcout, **aquifer)
+    result = compute_deposition(dcout, **aquifer, nullspace_objective=squared_lengths, warm_start=warm_start)
+
+    assert np.allclose(result, expected, atol=1e-5)
+
+
+def test_deposition_coefficients_cached(aquifer, dcout_index):
+    coeff, df, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    coeff_cached, df_cached, index_dep_cached = deposition_coefficients(dcout_index.copy(), **aquifer)
+
+    assert coeff_cached is coeff
+    assert df_cached is df
+    assert index_dep_cached is index_dep
+
+    # Different flow values are not served from the cache
+    flow = aquifer["flow"] * 1.1
+    coeff_flow, _, _ = deposition_coefficients(dcout_index, **{**aquifer, "flow": flow})
+    assert coeff_flow is not coeff
+    assert not np.allclose(coeff_flow.sum(axis=1), coeff.sum(axis=1))
+
+
+def test_compute_deposition_summed_lengths(aquifer, dcout_index):
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    deposition = pd.Series(1.0 + 0.5 * np.sin(np.arange(len(index_dep)) / 10.0), index=index_dep)
+    dcout = compute_dc(dcout_index, deposition, **aquifer)
+
+    squared_lengths = compute_deposition(dcout, **aquifer)
+    summed_lengths = compute_deposition(dcout, **aquifer, nullspace_objective="summed_lengths")
+
+    assert np.allclose(compute_dc(dcout_index, summed_lengths, **aquifer), dcout, rtol=1e-6)
+    assert np.abs(np.diff(summed_lengths)).sum() < np.abs(np.diff(squared_lengths)).sum()
+
+
+def test_compute_deposition_threads(aquifer, dcout_index):
+    """Parameter sweeps can run in parallel threads, also when they evict each other from the cache."""
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    dcout = compute_dc(dcout_index, pd.Series(1.0, index=index_dep), **aquifer)
+    pore_volumes = aquifer["aquifer_pore_volume"] * np.linspace(0.9, 1.0, 12)
+
+    def compute(aquifer_pore_volume):
+        return compute_deposition(dcout, **{**aquifer, "aquifer_pore_volume": aquifer_pore_volume})
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(compute, pore_volumes))
+
+    for aquifer_pore_volume, result in zip(pore_volumes, results, strict=True):
+        assert np.allclose(result, compute(aquifer_pore_volume))
+
+
+def test_compute_deposition_flow_not_aligned(aquifer, dcout_index):
+    _, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+    dcout = compute_dc(dcout_index, pd.Series(1.0, index=index_dep), **aquifer)
+    flow = aquifer["flow"].copy()
+    flow.index += pd.Timedelta(hours=12)
+
+    with pytest.raises(ValueError, match="not long enough"):
+        compute_deposition(dcout, **{**aquifer, "flow": flow})
+
+
+def test_deposition_coefficients_zero_porosity(aquifer, dcout_index):
+    with pytest.raises(ValueError, match="nonzero"):
+        deposition_coefficients(dcout_index, **{**aquifer, "porosity": 0.0})
+
+
+def test_deposition_coefficients_infiltration_just_after_midnight():
+    """The first infiltration date falls a few nanoseconds after the start of the deposition index."""
+    flow = pd.Series(1.0, index=pd.date_range("2020-01-01", periods=200, freq="D"))
+    dcout_index = pd.date_range(pd.Timestamp("2020-03-01") + pd.Timedelta(0.57, "D"), periods=60, freq="D")
+
+    coeff, _, _ = deposition_coefficients(
+        dcout_index, flow, 20.57, porosity=0.3, thickness=10.0, retardation_factor=1.0
+    )
+
+    assert coeff.indices.min() >= 0
+    assert np.allclose(coeff.toarray().sum(axis=1) * 3.0, 20.57)
+
+
+def test_deposition_coefficients_tz_aware():
+    flow = pd.Series(1.0, index=pd.date_range("2020-01-01", periods=200, freq="D", tz="UTC"))
+    dcout_index = pd.date_range("2020-03-01 13:00", periods=60, freq="D", tz="UTC")
+
+    coeff, df, index_dep = deposition_coefficients(
+        dcout_index, flow, 20.0, porosity=0.3, thickness=10.0, retardation_factor=1.0
+    )
+
+    assert str(index_dep.tz) == "UTC"
+    assert index_dep[0] == pd.Timestamp("2020-02-10", tz="UTC")
+    assert str(df.dates_infiltration_retarded.dt.tz) == "UTC"
+    assert np.allclose(coeff.toarray().sum(axis=1) * 3.0, 20.0)
+
+
+def test_deposition_coefficients_cached_timezone(aquifer, dcout_index):
+    """Indices with the same instants in a different timezone are not served from the cache."""
+    coeff, _, index_dep = deposition_coefficients(dcout_index, **aquifer)
+
+    flow = aquifer["flow"].tz_localize("UTC")
+    coeff_tz, df_tz, index_dep_tz = deposition_coefficients(dcout_index.tz_localize("UTC"), **{**aquifer, "flow": flow})
+
+    assert str(index_dep_tz.tz) == "UTC"
+    assert str(df_tz.index.tz) == "UTC"
+    assert index_dep_tz.tz_localize(None).equals(index_dep)
+    assert np.allclose(coeff_tz.toarray(), coeff.toarray())
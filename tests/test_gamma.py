@@ -12,7 +12,7 @@ from gwtransport1d.gamma import (
 
 
 # Fixtures
-@pytest.fixture
+@pytest.fixture(scope="module")
 def sample_time_series():
     """Create sample time series data for testing."""
     dates = pd.date_range(start="2020-01-01", end="2020-12-31", freq="D")
@@ -21,7 +21,7 @@ def sample_time_series():
     return concentration, flow
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def gamma_params():
     """Sample gamma distribution parameters."""
     return {
@@ -1,7 +1,10 @@
 import numpy as np
+import pytest
 from numpy.testing import assert_array_almost_equal
+from scipy.linalg import null_space
+from scipy.sparse import csr_array
 
-from gwtransport1d.utils import linear_interpolate
+from gwtransport1d.utils import linear_interpolate, lstsq_null_space, lstsq_null_space_sparse
 
 
 def test_linear_interpolate():
@@ -49,3 +52,80 @@ def test_linear_interpolate():
 
     result = linear_interpolate(x_ref, y_ref, x_query)
     assert_array_almost_equal(result, expected, decimal=6)
+
+
+def test_lstsq_null_space():
+    rng = np.random.default_rng(0)
+    a = rng.random((5, 8))
+    b = rng.random(5)
+
+    x, cols_of_nullspace = lstsq_null_space(a, b)
+
+    # Same minimum norm solution as numpy
+    assert_array_almost_equal(x, np.linalg.lstsq(a, b, rcond=None)[0], decimal=10)
+
+    # Orthonormal basis spanning the same nullspace as scipy
+    assert cols_of_nullspace.shape == (8, 3)
+    assert_array_almost_equal(a @ cols_of_nullspace, np.zeros((5, 3)), decimal=10)
+    assert_array_almost_equal(cols_of_nullspace.T @ cols_of_nullspace, np.eye(3), decimal=10)
+    projection = cols_of_nullspace @ cols_of_nullspace.T
+    expected = null_space(a) @ null_space(a).T
+    assert_array_almost_equal(projection, expected, decimal=10)
+
+
+def test_lstsq_null_space_sparse():
+    # Banded matrix with full row rank, similar to the deposition coefficients
+    rng = np.random.default_rng(1)
+    nrows, bandwidth = 400, 30
+    a = np.zeros((nrows, nrows + bandwidth))
+    for i in range(nrows):
+        a[i, i : i + bandwidth + 1] = rng.random(bandwidth + 1)
+    b = rng.random(nrows)
+
+    x, cols_of_nullspace = lstsq_null_space_sparse(csr_array(a), b)
+    x_expected, cols_of_nullspace_expected = lstsq_null_space(a, b)
+
+    assert cols_of_nullspace.shape == (nrows + bandwidth, bandwidth)
+    assert_array_almost_equal(x, x_expected, decimal=10)
+    assert_array_almost_equal(cols_of_nullspace.T @ cols_of_nullspace, np.eye(bandwidth), decimal=10)
+    projection = cols_of_nullspace @ cols_of_nullspace.T
+    projection_expected = cols_of_nullspace_expected @ cols_of_nullspace_expected.T
+    assert_array_almost_equal(projection, projection_expected, decimal=10)
+
+    # Large sparse matrices are dispatched to the sparse solver
+    x_dispatched, _ = lstsq_null_space(csr_array(a), b)
+    assert_array_almost_equal(x_dispatched, x_expected, decimal=10)
+
+
+def test_lstsq_null_space_sparse_rank_deficient():
+    a = np.zeros((400, 420))
+    a[np.arange(400), np.arange(400)] = 1.0
+    a[-1] = a[-2]  # Linearly dependent rows
+    b = np.ones(400)
+
+    with pytest.raises(ValueError, match="full row rank"):
+        lstsq_null_space_sparse(csr_array(a), b)
+
+    # Falls back to SVD
+    x, cols_of_nullspace = lstsq_null_space(csr_array(a), b)
+    assert cols_of_nullspace.shape == (420, 21)
+    assert_array_almost_equal(a @ x, b, decimal=10)
+
+
+def test_lstsq_null_space_sparse_nearly_rank_deficient():
+    rng = np.random.default_rng(1)
+    nrows, bandwidth = 400, 30
+    a = np.zeros((nrows, nrows + bandwidth))
+    for i in range(nrows):
+        a[i, i : i + bandwidth + 1] = rng.random(bandwidth + 1)
+    a[1:11] = a[:10] + 1e-7 * rng.random((10, nrows + bandwidth))  # Nearly linearly dependent rows
+    b = rng.random(nrows)
+
+    with pytest.raises(ValueError, match="nearly linearly dependent"):
+        lstsq_null_space_sparse(csr_array(a), b)
+
+    # Falls back to SVD
+    x, cols_of_nullspace = lstsq_null_space(csr_array(a), b)
+    x_expected, cols_of_nullspace_expected = lstsq_null_space(a, b)
+    assert_array_almost_equal(x, x_expected, decimal=10)
+    assert_array_almost_equal(cols_of_nullspace, cols_of_nullspace_expected, decimal=10)